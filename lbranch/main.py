@@ -4,10 +4,11 @@
 
 import argparse
 import os
-import platform
-import re
 import subprocess
 import sys
+from collections import namedtuple
+from contextlib import closing
+from functools import lru_cache
 
 from .version import __version__
 
@@ -38,68 +39,84 @@ EXIT_CHECKOUT_FAILED = EXIT_TEMPFAIL  # Branch checkout failed, retry possible (
 EXIT_INTERRUPTED = 130  # Operation interrupted (Ctrl+C) - shell standard
 
 
+# Reflog subject git writes for every branch switch
+CHECKOUT_PREFIX = 'checkout: moving from '
+
+# Parsed branch history, stored in the git dir and keyed on the HEAD reflog
+CACHE_FILE = 'lbranch-cache'
+
+
 # Colors for output - with fallback detection
-def supports_color():
+Colors = namedtuple('Colors', ['red', 'green', 'blue', 'nc'])
+ANSI_COLORS = Colors(
+    red='\033[0;31m', green='\033[0;32m', blue='\033[0;34m', nc='\033[0m'
+)
+NO_COLORS = Colors(red='', green='', blue='', nc='')
+
+
+def supports_color(*, isatty=None, system=None, env=None):
     """
     Returns True if the terminal supports color, False otherwise.
     Falls back to no-color on non-TTY or Windows (unless FORCE_COLOR is set).
+
+    isatty, system and env override sys.stdout.isatty(), platform.system() and
+    os.environ; the real values are only looked up when they're needed.
     """
+    if env is None:
+        env = os.environ
+
     # Return True if the FORCE_COLOR environment variable is set
-    if os.environ.get('FORCE_COLOR', '').lower() in ('1', 'true', 'yes', 'on'):
+    if env.get('FORCE_COLOR', '').lower() in ('1', 'true', 'yes', 'on'):
         return True
 
     # Return False if NO_COLOR environment variable is set (honor convention)
-    if os.environ.get('NO_COLOR', ''):
+    if env.get('NO_COLOR', ''):
         return False
 
     # Return False if not connected to a terminal
-    if not sys.stdout.isatty():
+    if isatty is None:
+        isatty = sys.stdout.isatty()
+    if not isatty:
         return False
 
-    # On Windows, check if running in a terminal that supports ANSI
-    if platform.system() == 'Windows':
+    # On Windows, check if running in a terminal that supports ANSI.
+    # platform is only needed here, so it's imported lazily to keep startup fast.
+    if system is None:
+        import platform
+
+        system = platform.system()
+
+    if system == 'Windows':
         # Windows Terminal and modern PowerShell support colors
         # Older Windows consoles may not
         # Simple check for modern Windows terminals
-        return (
-            os.environ.get('WT_SESSION')
-            or os.environ.get('TERM')
-            or 'ANSICON' in os.environ
-        )
+        return env.get('WT_SESSION') or env.get('TERM') or 'ANSICON' in env
 
     # Most Unix terminals support colors
     return True
 
 
-# Set up colors based on environment
-if supports_color():
-    RED = '\033[0;31m'
-    GREEN = '\033[0;32m'
-    BLUE = '\033[0;34m'
-    NC = '\033[0m'  # No Color
-else:
-    # No colors if not supported
-    RED = ''
-    GREEN = ''
-    BLUE = ''
-    NC = ''
+@lru_cache(maxsize=None)
+def terminal_supports_color():
+    """Return supports_color() for the real terminal, detected once per process"""
+    return supports_color()
+
+
+# Active palette, chosen in main() from the environment and command line flags
+_colors = NO_COLORS
 
 
 def print_error(message, exit_code=EXIT_SOFTWARE):
     """Print error message and exit with specified code"""
-    print(f'{RED}Error: {message}{NC}', file=sys.stderr)
+    print(f'{_colors.red}Error: {message}{_colors.nc}', file=sys.stderr)
     sys.exit(exit_code)
 
 
 def run_command(cmd, check=True, capture_output=True):
-    """Run a shell command and handle errors"""
+    """Run a command given as an argv list and handle errors"""
     try:
         result = subprocess.run(
-            cmd,
-            check=check,
-            text=True,
-            shell=isinstance(cmd, str),
-            capture_output=capture_output,
+            cmd, check=check, text=True, capture_output=capture_output
         )
         return result
     except subprocess.CalledProcessError as e:
@@ -109,8 +126,8 @@ def run_command(cmd, check=True, capture_output=True):
         sys.exit(EXIT_SOFTWARE)
 
 
-def parse_arguments():
-    """Parse command line arguments using argparse"""
+def build_parser():
+    """Build the argparse parser for the command line interface"""
     parser = argparse.ArgumentParser(
         description='Show recently checked out Git branches in chronological order',
         epilog='Example: lbranch -n 10 -s (shows the last 10 branches with option to '
@@ -146,145 +163,351 @@ def parse_arguments():
         action='store_true',
         help='Force colored output even in non-TTY environments',
     )
+    parser.add_argument(
+        '--mode',
+        choices=['reflog', 'refs'],
+        default='reflog',
+        help='Order branches by last checkout (reflog) or by last commit (refs) '
+        '(default: reflog)',
+    )
+
+    return parser
+
+
+# Built once and reused by every parse_arguments() call
+_PARSER = build_parser()
+
+
+def parse_arguments(argv=None):
+    """Parse command line arguments, defaulting to sys.argv[1:]"""
+    return _PARSER.parse_args(argv)
+
+
+def read_current_branch(git_dir=None):
+    """Return the checked out branch by reading HEAD without spawning git.
+
+    Args:
+        git_dir: Path to the git directory (default: $GIT_DIR or '.git')
 
-    return parser.parse_args()
+    Returns:
+        The branch name, or None if HEAD is detached or can't be read here
+        (e.g. from a subdirectory or a linked worktree)
+    """
+    if git_dir is None:
+        git_dir = os.environ.get('GIT_DIR', '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+
+    ref_prefix = 'ref: refs/heads/'
+    if not head.startswith(ref_prefix):
+        return None
+    branch = head[len(ref_prefix) :]
+    # The reftable backend leaves a placeholder HEAD file behind
+    if branch == '.invalid':
+        return None
+    return branch
+
+
+def reflog_scan_window(number):
+    """Return how many checkout entries to scan for number distinct branches."""
+    return max(number * 20, 1000)
+
+
+def iter_reflog(number):
+    """Yield reflog checkout entries line by line as git produces them.
+
+    Only the reflog subjects (``%gs``) of checkout entries are requested, capped
+    well above ``number`` so enough distinct branches survive deduplication.
+    Falls back to the plain ``git reflog`` output on gits that reject the
+    filtered form. Closing the generator early terminates git.
+    """
+    filtered = [
+        'git',
+        'reflog',
+        '-n',
+        str(reflog_scan_window(number)),
+        f'--grep-reflog=^{CHECKOUT_PREFIX}',
+        '--pretty=%gs',
+    ]
+    # Old gits reject the filtered form; stay quiet and retry with plain reflog
+    for cmd, stderr in ((filtered, subprocess.DEVNULL), (['git', 'reflog'], None)):
+        with subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=stderr, text=True
+        ) as proc:
+            try:
+                yield from proc.stdout
+            except GeneratorExit:
+                # The caller has enough branches; don't wait for the rest
+                proc.terminate()
+                raise
+        if proc.returncode == 0:
+            return
+    print_error('Command failed: git reflog')
 
 
-def extract_branches_from_reflog(reflog_output, current_branch):
+def extract_branches_from_reflog(reflog_lines, current_branch, limit=None):
     """Extract unique branch names from git reflog output.
 
     Args:
-        reflog_output: The output from 'git reflog' command
+        reflog_lines: Reflog lines, either checkout subjects or full 'git reflog'
         current_branch: The name of the current branch to exclude
+        limit: Stop once this many branches are found (default: no limit)
 
     Returns:
         A list of unique branch names in chronological order (most recent first)
     """
     branches = []
-    for line in reflog_output.splitlines():
-        # Look for checkout lines without using grep
-        if 'checkout: moving from' in line.lower():
-            # Parse the branch name after "from"
-            parts = line.split()
-            try:
-                from_index = parts.index('from')
-                if from_index + 1 < len(parts):
-                    branch = parts[from_index + 1]
-
-                    # Skip empty, current branch, or branches starting with '{'
-                    if not branch or branch == current_branch or branch.startswith('{'):
-                        continue
-
-                    # Only add branch if it's not already in the list
-                    if branch not in branches:
-                        branches.append(branch)
-            except ValueError:
-                continue  # "from" not found in this line
+    seen = set()
+    for line in reflog_lines:
+        # Parse the branch name after "checkout: moving from"
+        _, found, rest = line.partition(CHECKOUT_PREFIX)
+        if not found:
+            continue
+        branch = rest.partition(' ')[0]
+
+        # Skip empty, current branch, or branches starting with '{'
+        if not branch or branch == current_branch or branch.startswith('{'):
+            continue
+
+        # Only add branch if it's not already in the list
+        if branch in seen:
+            continue
+        seen.add(branch)
+        branches.append(branch)
+        if limit is not None and len(branches) >= limit:
+            break
     return branches
 
 
-def main():
-    """Main entry point for the lbranch command."""
-    args = parse_arguments()
+def list_recent_refs(number, current_branch):
+    """List local branches by most recent commit, excluding the current branch.
+
+    Args:
+        number: The number of branches wanted
+        current_branch: The name of the current branch to exclude
 
-    # Handle manual color override options
-    global RED, GREEN, BLUE, NC
+    Returns:
+        Up to number branch names, most recently committed first
+    """
+    result = run_command(
+        [
+            'git',
+            'for-each-ref',
+            '--sort=-committerdate',
+            # Not :short, which disambiguates to heads/<name> when a tag
+            # shares the branch's name
+            '--format=%(refname:lstrip=2)',
+            f'--count={number + 1}',
+            'refs/heads/',
+        ],
+        capture_output=True,
+    )
+    branches = [b for b in result.stdout.splitlines() if b != current_branch]
+    return branches[:number]
+
+
+def reflog_cache_key(git_dir, current_branch):
+    """Return a key that changes whenever the HEAD reflog or current branch does.
+
+    The reflog only grows between expiries, so its size and mtime together
+    identify its contents. Returns None if the reflog can't be found.
+    """
+    try:
+        st = os.stat(os.path.join(git_dir, 'logs', 'HEAD'))
+    except OSError:
+        return None
+    return f'{st.st_mtime_ns} {st.st_size} {current_branch}'
+
+
+def load_cached_branches(git_dir, key, limit):
+    """Return the cached branch list if it is still valid for key and limit.
+
+    Returns None when there is no usable cache. A cached list shorter than the
+    limit it was built with holds every branch in the reflog entries scanned
+    for it, so it also satisfies larger limits that scan no further back.
+    """
+    if key is None:
+        return None
+    try:
+        with open(os.path.join(git_dir, CACHE_FILE)) as f:
+            header = f.readline().rstrip('\n')
+            branches = f.read().splitlines()
+    except OSError:
+        return None
+
+    # The header is the key followed by the limit and scan window it was built with
+    fields = header.rsplit(' ', 2)
+    if len(fields) != 3 or fields[0] != key:
+        return None
+    cached_limit, cached_window = fields[1:]
+    if not (cached_limit.isdecimal() and cached_window.isdecimal()):
+        return None
+    if int(cached_limit) < limit and (
+        len(branches) >= int(cached_limit)
+        or reflog_scan_window(limit) > int(cached_window)
+    ):
+        return None
+    return branches
+
+
+def save_cached_branches(git_dir, key, limit, branches):
+    """Atomically replace the branch cache; failures are silently ignored."""
+    if key is None:
+        return
+    # tempfile pulls in random and shutil, so only import it when writing
+    import tempfile
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=f'{CACHE_FILE}.', dir=git_dir)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(f'{key} {limit} {reflog_scan_window(limit)}\n')
+            f.writelines(f'{branch}\n' for branch in branches)
+        os.replace(tmp_path, os.path.join(git_dir, CACHE_FILE))
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def collect_branches(mode, number, git_dir, current_branch):
+    """Return up to number recent branches other than the current one.
+
+    Args:
+        mode: 'reflog' for checkout order or 'refs' for commit date order
+        number: The number of branches wanted
+        git_dir: Path to the repository's git directory
+        current_branch: The name of the current branch to exclude
+    """
+    if mode == 'refs':
+        # Get branches by commit date straight from the refs
+        return list_recent_refs(number, current_branch)
+
+    # Get unique branch history, reusing the cached result while the reflog
+    # is unchanged
+    cache_key = reflog_cache_key(git_dir, current_branch)
+    branches = load_cached_branches(git_dir, cache_key, number)
+    if branches is None:
+        with closing(iter_reflog(number)) as reflog_lines:
+            branches = extract_branches_from_reflog(
+                reflog_lines, current_branch, number
+            )
+        save_cached_branches(git_dir, cache_key, number, branches)
+    return branches
+
+
+def format_branch_list(branches, number, colors=NO_COLORS):
+    """Return the numbered listing of at most number branches, with its header."""
+    lines = [f'{colors.blue}Last {number} branches:{colors.nc}']
+    lines.extend(f'{i}) {branch}' for i, branch in enumerate(branches[:number], 1))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    """Main entry point for the lbranch command.
+
+    Args:
+        argv: Command line arguments, excluding the program name
+            (default: sys.argv[1:])
+    """
+    args = parse_arguments(argv)
+
+    # Pick colors, honoring the manual override options
+    global _colors
     if args.no_color:
-        RED = GREEN = BLUE = NC = ''
-    elif args.force_color:
-        RED = '\033[0;31m'
-        GREEN = '\033[0;32m'
-        BLUE = '\033[0;34m'
-        NC = '\033[0m'
-
-    # Check if git is installed
+        _colors = NO_COLORS
+    elif args.force_color or terminal_supports_color():
+        _colors = ANSI_COLORS
+    else:
+        _colors = NO_COLORS
+
+    # Check that git is installed, we're in a repository and it has commits.
+    # A single rev-parse answers all three: it prints the git dir whenever we're
+    # inside a repository and only fails to verify HEAD when there are no commits.
     try:
-        run_command(['git', '--version'], capture_output=True)
+        result = run_command(
+            ['git', 'rev-parse', '--git-dir', '--verify', 'HEAD'],
+            check=False,
+            capture_output=True,
+        )
     except FileNotFoundError:
         print_error(
             'git command not found. Please install git first.', EXIT_GIT_NOT_FOUND
         )
 
-    # Check if we're in a git repository
-    if (
-        run_command(
-            ['git', 'rev-parse', '--is-inside-work-tree'],
-            check=False,
-            capture_output=True,
-        ).returncode
-        != 0
-    ):
+    git_dir = result.stdout.partition('\n')[0]
+    if not git_dir:
         print_error(
             'Not a git repository. Please run this command from within a git '
             'repository.',
             EXIT_NOT_A_GIT_REPO,
         )
 
-    # Check if the repository has any commits
-    if (
-        run_command(
-            ['git', 'rev-parse', '--verify', 'HEAD'], check=False, capture_output=True
-        ).returncode
-        != 0
-    ):
-        print(f'{BLUE}No branch history found - repository has no commits yet{NC}')
+    if result.returncode != 0:
+        print(
+            f'{_colors.blue}No branch history found - repository has no commits yet'
+            f'{_colors.nc}'
+        )
         sys.exit(EXIT_NO_COMMITS)
 
-    # Get current branch name
-    try:
-        current_branch = run_command(
-            ['git', 'symbolic-ref', '--short', 'HEAD'], capture_output=True
-        ).stdout.strip()
-    except subprocess.CalledProcessError:
-        current_branch = run_command(
-            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True
-        ).stdout.strip()
-
-    # Get unique branch history
-    reflog_output = run_command(['git', 'reflog'], capture_output=True).stdout
-    branches = extract_branches_from_reflog(reflog_output, current_branch)
-
-    # Limit to requested number of branches
-    total_branches = len(branches)
-    if total_branches == 0:
-        print(f'{BLUE}Last {args.number} branches:{NC}')
+    # Get current branch name, reading HEAD directly when possible
+    current_branch = read_current_branch(git_dir)
+    if current_branch is None:
+        # run_command exits on failure, so check symbolic-ref's status here
+        # and fall back to the commit hash when HEAD is detached
+        result = run_command(
+            ['git', 'symbolic-ref', '-q', '--short', 'HEAD'],
+            check=False,
+            capture_output=True,
+        )
+        if result.returncode == 0:
+            current_branch = result.stdout.strip()
+        else:
+            current_branch = run_command(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True
+            ).stdout.strip()
+
+    branches = collect_branches(args.mode, args.number, git_dir, current_branch)
+
+    # Display branches, building the listing up front so it's written at once
+    sys.stdout.write(format_branch_list(branches, args.number, _colors))
+    if not branches:
         sys.exit(EXIT_SUCCESS)
 
-    branch_limit = min(args.number, total_branches)
+    branch_limit = min(args.number, len(branches))
     branches = branches[:branch_limit]  # Limit to requested count
 
-    # Display branches
-    print(f'{BLUE}Last {args.number} branches:{NC}')
-    for i, branch in enumerate(branches, 1):
-        print(f'{i}) {branch}')
-
     # Handle select mode
     if args.select:
         try:
             branch_num = input(
-                f'\n{GREEN}Enter branch number to checkout (1-{branch_limit}): {NC}'
+                f'\n{_colors.green}Enter branch number to checkout '
+                f'(1-{branch_limit}): {_colors.nc}'
             )
 
-            if (
-                not re.match(r'^\d+$', branch_num)
-                or int(branch_num) < 1
-                or int(branch_num) > branch_limit
-            ):
+            if not branch_num.isdecimal():
+                print_error(f'Invalid selection: {branch_num}', EXIT_INVALID_SELECTION)
+            index = int(branch_num)
+            if not 1 <= index <= branch_limit:
                 print_error(f'Invalid selection: {branch_num}', EXIT_INVALID_SELECTION)
 
-            selected_branch = branches[int(branch_num) - 1]
+            selected_branch = branches[index - 1]
             print(f'\nChecking out: {selected_branch}')
+            sys.stdout.flush()
 
-            # Attempt to checkout the branch
+            # Attempt to checkout the branch, letting git report the outcome
+            # directly instead of buffering its output through pipes
             result = run_command(
-                ['git', 'checkout', selected_branch], check=False, capture_output=True
+                ['git', 'checkout', selected_branch], check=False, capture_output=False
             )
             if result.returncode != 0:
-                print_error(
-                    f'Failed to checkout branch:\n{result.stderr}', EXIT_CHECKOUT_FAILED
-                )
-
-            print(f'{GREEN}Successfully checked out {selected_branch}{NC}')
+                print_error('Failed to checkout branch', EXIT_CHECKOUT_FAILED)
         except KeyboardInterrupt:
             print('\nOperation cancelled.')
             sys.exit(EXIT_INTERRUPTED)
@@ -1,62 +1,251 @@
 #!/usr/bin/env python3
+import functools
 import os
+import shutil
 import subprocess
-import sys
 import tempfile
 import unittest
-from io import StringIO
 from unittest import mock
 
+import pytest
+
 from lbranch.main import (
+    ANSI_COLORS,
     EXIT_INTERRUPTED,
     EXIT_INVALID_SELECTION,
     EXIT_NO_COMMITS,
     EXIT_NOINPUT,
+    EXIT_SOFTWARE,
     EXIT_SUCCESS,
     EXIT_USAGE,
+    extract_branches_from_reflog,
+    format_branch_list,
     main,
+    read_current_branch,
     supports_color,
 )
 
+# Test repositories are throwaway, so keep them in memory where possible.
+# Set LBRANCH_TEST_TMPDIR to override; falls back to the system default.
+TEST_TMPDIR = os.environ.get('LBRANCH_TEST_TMPDIR') or (
+    '/dev/shm' if os.path.isdir('/dev/shm') else None
+)
 
-class TestLBranch(unittest.TestCase):
-    def setUp(self):
-        self.test_dir = tempfile.mkdtemp()
-        self.original_dir = os.getcwd()
-
-        # Setup test repository
-        os.chdir(self.test_dir)
-        subprocess.run(['git', 'init'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'config', '--local', 'user.email', 'test@example.com'],
-            capture_output=True,
-            check=True,
+# Environment for test repositories: a commit identity, so no per-repository
+# git config is needed, no optional index-refresh locks, and no user or system
+# config files, so git skips reading them and they can't change test results
+GIT_TEST_ENV = {
+    'GIT_AUTHOR_NAME': 'Test User',
+    'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'Test User',
+    'GIT_COMMITTER_EMAIL': 'test@example.com',
+    'GIT_OPTIONAL_LOCKS': '0',
+    'GIT_CONFIG_GLOBAL': os.devnull,
+    'GIT_CONFIG_NOSYSTEM': '1',
+    'GIT_TERMINAL_PROMPT': '0',
+}
+
+# Git settings applied to every git call made by the tests, including lbranch's.
+# Test repositories are short-lived, so skip durability and housekeeping work.
+# Reflogs stay enabled (the default) since lbranch reads them.
+GIT_TEST_CONFIG = {
+    'core.fsync': 'none',
+    'gc.auto': '0',
+    'maintenance.auto': 'false',
+}
+
+# Raw commit timestamp of the template's initial commit; each test's own
+# commits follow it one second apart
+COMMIT_EPOCH = 1700000000
+
+
+# Run a command whose output the test doesn't need
+run_quiet = functools.partial(
+    subprocess.run, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+)
+
+
+def git_config_env(settings):
+    """Return environment variables that apply settings to every git invocation"""
+    env = {}
+    count = int(os.environ.get('GIT_CONFIG_COUNT', '0'))
+    for key, value in settings.items():
+        env[f'GIT_CONFIG_KEY_{count}'] = key
+        env[f'GIT_CONFIG_VALUE_{count}'] = value
+        count += 1
+    env['GIT_CONFIG_COUNT'] = str(count)
+    return env
+
+
+def link_or_copy(src, dst):
+    """Hard-link git object files and copy everything else.
+
+    Objects are immutable once written, so copies can share them. Refs, logs
+    and the index may be updated in place and must stay private to each copy.
+    """
+    if f'{os.sep}objects{os.sep}' in src:
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
+def fast_import_commit(branch_name, path, content, date, message=None, parent=None):
+    """Return a git fast-import stanza that commits one file to a branch
+
+    date is in git's raw format ('<unix timestamp> <utc offset>').
+    """
+
+    def data(text):
+        return f'data {len(text.encode())}\n{text}\n'
+
+    stanza = [
+        f'commit refs/heads/{branch_name}\n',
+        f'committer Test User <test@example.com> {date}\n',
+        data(message or f'commit on {branch_name}'),
+    ]
+    if parent:
+        stanza.append(f'from {parent}\n')
+    stanza += [f'M 100644 inline {path}\n', data(content)]
+    return ''.join(stanza)
+
+
+def fast_import(repo_dir, stanzas):
+    """Write all stanzas to the repository with one git fast-import"""
+    run_quiet(
+        ['git', 'fast-import', '--quiet', '--date-format=raw'],
+        cwd=repo_dir,
+        input=''.join(stanzas),
+        text=True,
+    )
+
+
+@pytest.fixture(scope='module')
+def template_repo():
+    """
+    Initialize a repository with an initial commit on main once for every
+    test in the module
+    """
+    # The test environment stays applied while the module's tests run
+    env = {**GIT_TEST_ENV, **git_config_env(GIT_TEST_CONFIG)}
+    with mock.patch.dict(os.environ, env):
+        template_dir = tempfile.mkdtemp(dir=TEST_TMPDIR)
+        run_quiet(['git', 'init', '-q', '-b', 'main'], cwd=template_dir)
+        fast_import(
+            template_dir,
+            [
+                fast_import_commit(
+                    'main', 'README.md', 'initial', f'{COMMIT_EPOCH} +0000', 'initial'
+                )
+            ],
         )
-        subprocess.run(
-            ['git', 'config', '--local', 'user.name', 'Test User'],
-            capture_output=True,
-            check=True,
+        yield template_dir
+    shutil.rmtree(template_dir, ignore_errors=True)
+
+
+class TestLBranch(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def repo(self, template_repo, monkeypatch, capsys):
+        """Give each test its own copy of the template repository"""
+        self.capsys = capsys
+        self.commit_seq = 0
+        self.test_dir = tempfile.mkdtemp(dir=TEST_TMPDIR)
+        self.git_dir = os.path.join(self.test_dir, '.git')
+        shutil.copytree(
+            os.path.join(template_repo, '.git'),
+            self.git_dir,
+            copy_function=link_or_copy,
         )
+        self.monkeypatch = monkeypatch
+        yield
+        shutil.rmtree(self.test_dir, ignore_errors=True)
 
-    def tearDown(self):
-        os.chdir(self.original_dir)
-        subprocess.run(['rm', '-rf', self.test_dir], capture_output=True, check=True)
+    def next_commit_date(self):
+        """
+        Return a fixed, strictly increasing commit date in git's raw format.
+
+        Commit order then never depends on wall-clock time or host load.
+        """
+        self.commit_seq += 1
+        return f'{COMMIT_EPOCH + self.commit_seq} +0000'
 
     def create_branch_with_commit(self, branch_name, file_content):
         """Create a branch and add a commit to it"""
-        subprocess.run(
-            ['git', 'checkout', '-b', branch_name], capture_output=True, check=True
-        )
-        with open(f'{branch_name}.txt', 'w') as f:
-            f.write(file_content)
-        subprocess.run(
-            ['git', 'add', f'{branch_name}.txt'], capture_output=True, check=True
-        )
-        subprocess.run(
-            ['git', 'commit', '-m', f'commit on {branch_name}'],
-            capture_output=True,
-            check=True,
+        # Commit straight into a new branch ref on top of the current branch,
+        # then record the switch to it without another git process
+        fast_import(
+            self.test_dir,
+            [
+                fast_import_commit(
+                    branch_name,
+                    f'{branch_name}.txt',
+                    file_content,
+                    self.next_commit_date(),
+                    parent=f'refs/heads/{read_current_branch(self.git_dir)}^0',
+                )
+            ],
         )
+        self.record_checkouts([branch_name])
+
+    def branch_tip(self, branch_name):
+        """Return the commit a branch points at, read from its loose ref"""
+        with open(os.path.join(self.git_dir, 'refs', 'heads', branch_name)) as f:
+            return f.read().strip()
+
+    def create_branch(self, branch_name):
+        """Create a branch at the current commit without running git"""
+        tip = self.branch_tip(read_current_branch(self.git_dir))
+        with open(os.path.join(self.git_dir, 'refs', 'heads', branch_name), 'w') as f:
+            f.write(f'{tip}\n')
+
+    def record_checkouts(self, branches):
+        """
+        Check out each branch in turn by writing the HEAD reflog entries and
+        final HEAD that git checkout would produce, without running git.
+
+        Assumes the files ref backend with loose refs, as left by seed_repo().
+        The working tree and index are not updated. That is safe because the
+        tests never read or commit from them: all commits are written with
+        fast-import, and lbranch only looks at HEAD, refs and the reflog.
+        """
+        tip = self.branch_tip
+        previous = read_current_branch(self.git_dir)
+        entries = []
+        for branch_name in branches:
+            entries.append(
+                f'{tip(previous)} {tip(branch_name)} '
+                f'Test User <test@example.com> {self.next_commit_date()}\t'
+                f'checkout: moving from {previous} to {branch_name}\n'
+            )
+            previous = branch_name
+        with open(os.path.join(self.git_dir, 'logs', 'HEAD'), 'a') as f:
+            f.writelines(entries)
+        with open(os.path.join(self.git_dir, 'HEAD'), 'w') as f:
+            f.write(f'ref: refs/heads/{previous}\n')
+
+    def seed_repo(self, branches):
+        """
+        Add one commit per branch on top of the template's initial commit in a
+        single git fast-import run.
+
+        branches is a list of (branch_name, parent_branch) pairs, in creation
+        order. Each branch commit adds '<branch_name>.txt'. Only refs are
+        written; tests check branches out to record them in the reflog.
+        """
+        stanzas = []
+        for branch_name, parent in branches:
+            stanzas.append(
+                fast_import_commit(
+                    branch_name,
+                    f'{branch_name}.txt',
+                    f'{branch_name} content',
+                    self.next_commit_date(),
+                    parent=f'refs/heads/{parent}',
+                )
+            )
+        fast_import(self.test_dir, stanzas)
 
     def run_lbranch(self, args=None, expected_exit_code=None):
         """
@@ -69,28 +258,17 @@ class TestLBranch(unittest.TestCase):
         """
         if args is None:
             args = []
-        # Save original stdout and stderr
-        original_stdout = sys.stdout
-        original_stderr = sys.stderr
-        # Create string buffers to capture output
-        stdout_buffer = StringIO()
-        stderr_buffer = StringIO()
-        sys.stdout = stdout_buffer
-        sys.stderr = stderr_buffer
-        exit_code = EXIT_SUCCESS
-        try:
-            # Save original argv
-            original_argv = sys.argv
-            sys.argv = ['lbranch'] + args
+        # Discard anything captured before this run
+        self.capsys.readouterr()
+        # lbranch works on the repository in the current directory, so enter
+        # it only while main() runs
+        with self.monkeypatch.context() as m:
+            m.chdir(self.test_dir)
             try:
-                exit_code = main()
+                exit_code = main(args)
             except SystemExit as e:
                 exit_code = e.code
-        finally:
-            # Restore stdout, stderr and argv
-            sys.stdout = original_stdout
-            sys.stderr = original_stderr
-            sys.argv = original_argv
+        stdout_output, stderr_output = self.capsys.readouterr()
 
         if expected_exit_code is not None:
             self.assertEqual(
@@ -100,18 +278,15 @@ class TestLBranch(unittest.TestCase):
             )
 
         # Combine stdout and stderr
-        stdout_output = stdout_buffer.getvalue()
-        stderr_output = stderr_buffer.getvalue()
         combined_output = stdout_output + stderr_output
 
         return combined_output, exit_code
 
     def test_no_commits(self):
         """Test behavior when repository has no commits"""
-        # Create new branch without any commits
-        subprocess.run(
-            ['git', 'checkout', '-b', 'empty-branch'], capture_output=True, check=True
-        )
+        # Replace the template copy with a freshly initialized, empty repository
+        shutil.rmtree(self.git_dir)
+        run_quiet(['git', 'init', '-q'], cwd=self.test_dir)
 
         output, exit_code = self.run_lbranch(expected_exit_code=EXIT_NO_COMMITS)
         self.assertIn('No branch history found - repository has no commits yet', output)
@@ -121,18 +296,9 @@ class TestLBranch(unittest.TestCase):
 
     def test_first_branch_scenario(self):
         """Test behavior with main branch and new branch"""
-        # Create initial commit on main
-        with open('README.md', 'w') as f:
-            f.write('initial')
-        subprocess.run(['git', 'add', 'README.md'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'commit', '-m', 'initial'], capture_output=True, check=True
-        )
-
         # Create and checkout new branch
-        subprocess.run(
-            ['git', 'checkout', '-b', 'feature'], capture_output=True, check=True
-        )
+        self.create_branch('feature')
+        self.record_checkouts(['feature'])
 
         output, exit_code = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
         self.assertIn('Last 5 branches:', output)
@@ -141,19 +307,11 @@ class TestLBranch(unittest.TestCase):
 
     def test_exclude_current_branch(self):
         """Test that current branch is excluded from results"""
-        # Create initial commit on main
-        with open('README.md', 'w') as f:
-            f.write('initial')
-        subprocess.run(['git', 'add', 'README.md'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'commit', '-m', 'initial'], capture_output=True, check=True
-        )
-
         # Create feature branch with commit
-        self.create_branch_with_commit('feature', 'feature content')
+        self.seed_repo([('feature', 'main')])
 
-        # Checkout main
-        subprocess.run(['git', 'checkout', 'main'], capture_output=True, check=True)
+        # Checkout feature, then back to main
+        self.record_checkouts(['feature', 'main'])
 
         output, exit_code = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
         self.assertIn('Last 5 branches:', output)
@@ -161,23 +319,13 @@ class TestLBranch(unittest.TestCase):
         self.assertEqual(EXIT_SUCCESS, exit_code)
 
     def test_branch_order_and_format(self):
-        # Create initial commit on main
-        with open('README.md', 'w') as f:
-            f.write('initial')
-        subprocess.run(['git', 'add', 'README.md'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'commit', '-m', 'initial'], capture_output=True, check=True
+        # Create branches with actual commits
+        self.seed_repo(
+            [('dev', 'main'), ('b1', 'dev'), ('b2', 'dev'), ('b3', 'b1'), ('b4', 'dev')]
         )
 
-        # Create branches with actual commits
-        self.create_branch_with_commit('dev', 'dev content')
-        self.create_branch_with_commit('b1', 'b1 content')
-        subprocess.run(['git', 'checkout', 'dev'], capture_output=True, check=True)
-        self.create_branch_with_commit('b2', 'b2 content')
-        subprocess.run(['git', 'checkout', 'b1'], capture_output=True, check=True)
-        self.create_branch_with_commit('b3', 'b3 content')
-        subprocess.run(['git', 'checkout', 'dev'], capture_output=True, check=True)
-        self.create_branch_with_commit('b4', 'b4 content')
+        # Switch between them to build the reflog history
+        self.record_checkouts(['dev', 'b1', 'dev', 'b2', 'b1', 'b3', 'dev', 'b4'])
 
         output, exit_code = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
         self.assertIn('Last 5 branches:', output)
@@ -190,52 +338,152 @@ class TestLBranch(unittest.TestCase):
 
     def test_custom_number(self):
         """Test specifying a custom number of branches to show"""
-        # Create initial commit on main
-        with open('README.md', 'w') as f:
-            f.write('initial')
-        subprocess.run(['git', 'add', 'README.md'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'commit', '-m', 'initial'], capture_output=True, check=True
-        )
-
         # Create branches with actual commits
-        self.create_branch_with_commit('dev', 'dev content')
-        self.create_branch_with_commit('b1', 'b1 content')
-        subprocess.run(['git', 'checkout', 'dev'], capture_output=True, check=True)
-        self.create_branch_with_commit('b2', 'b2 content')
+        self.seed_repo([('dev', 'main'), ('b1', 'dev'), ('b2', 'dev')])
+
+        # Switch between them to build the reflog history
+        self.record_checkouts(['dev', 'b1', 'dev', 'b2'])
+
+        # Both spellings of the option, each checked as its own subtest
+        for option, number, expected in [
+            ('-n', 2, ['dev', 'b1']),
+            ('--number', 3, ['dev', 'b1', 'main']),
+        ]:
+            with self.subTest(option=option):
+                output, exit_code = self.run_lbranch(
+                    [option, str(number)], expected_exit_code=EXIT_SUCCESS
+                )
+                self.assertIn(f'Last {number} branches:', output)
+                for i, branch in enumerate(expected, 1):
+                    self.assertIn(f'{i}) {branch}', output)
+                self.assertNotIn(f'{number + 1}) ', output)
+                self.assertEqual(EXIT_SUCCESS, exit_code)
+
+    def test_reflog_cache(self):
+        """Test that cached branch history is reused and refreshed on checkout"""
+        # Create feature branch with commit
+        self.create_branch_with_commit('feature', 'feature content')
+
+        output, _ = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
+        self.assertIn('1) main', output)
+        self.assertTrue(os.path.exists(os.path.join(self.git_dir, 'lbranch-cache')))
+
+        # Cached result is served while the reflog is unchanged
+        with mock.patch('lbranch.main.iter_reflog') as iter_reflog:
+            output, _ = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
+        iter_reflog.assert_not_called()
+        self.assertIn('1) main', output)
+
+        # A checkout touches the reflog and invalidates the cache
+        run_quiet(['git', 'checkout', '-q', '-b', 'other'], cwd=self.test_dir)
+        output, _ = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
+        self.assertIn('1) feature', output)
+        self.assertIn('2) main', output)
+
+    def test_reflog_cache_larger_number(self):
+        """Test that a cache built for a smaller -n doesn't shorten a larger one"""
+        # x is only reachable from a scan window larger than the default one
+        self.seed_repo([('x', 'main'), ('y', 'main')])
+        self.record_checkouts(['x', 'main'] + ['y', 'main'] * 1100)
+
+        output, _ = self.run_lbranch(['-n', '5'], expected_exit_code=EXIT_SUCCESS)
+        self.assertIn('1) y', output)
+        self.assertNotIn('2)', output)
+
+        output, _ = self.run_lbranch(['-n', '120'], expected_exit_code=EXIT_SUCCESS)
+        self.assertIn('1) y', output)
+        self.assertIn('2) x', output)
+
+    def patch_reflog_commands(self, failing):
+        """
+        Patch subprocess.Popen so that git reflog commands matching failing
+        exit non-zero without output; other commands run normally.
+        """
+        real_popen = subprocess.Popen
+
+        def popen(cmd, *args, **kwargs):
+            if cmd[:2] == ['git', 'reflog'] and failing(cmd):
+                cmd = ['git', 'rev-parse', '--verify', '-q', 'no-such-ref']
+            return real_popen(cmd, *args, **kwargs)
+
+        return mock.patch('subprocess.Popen', side_effect=popen)
+
+    def test_reflog_fallback(self):
+        """Test that plain git reflog is used when the filtered form fails"""
+        self.seed_repo([('feature', 'main')])
+        self.record_checkouts(['feature', 'main'])
+
+        def filtered(cmd):
+            return any(arg.startswith('--grep-reflog') for arg in cmd)
+
+        with self.patch_reflog_commands(filtered) as popen:
+            output, exit_code = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
+        reflog_calls = [
+            c.args[0] for c in popen.call_args_list if 'reflog' in c.args[0]
+        ]
+        self.assertEqual(['git', 'reflog'], reflog_calls[-1])
+        self.assertEqual(2, len(reflog_calls))
+        self.assertIn('1) feature', output)
+        self.assertEqual(EXIT_SUCCESS, exit_code)
+
+    def test_reflog_failure(self):
+        """Test that an error is reported when no form of git reflog works"""
+        self.seed_repo([('feature', 'main')])
+        self.record_checkouts(['feature', 'main'])
+
+        with self.patch_reflog_commands(lambda cmd: True):
+            output, exit_code = self.run_lbranch(expected_exit_code=EXIT_SOFTWARE)
+        self.assertIn('Command failed: git reflog', output)
+
+    def test_detached_head(self):
+        """Test that the current commit is found with git when HEAD is detached"""
+        self.seed_repo([('feature', 'main')])
+        self.record_checkouts(['feature', 'main'])
+        with open(os.path.join(self.git_dir, 'HEAD'), 'w') as f:
+            f.write(f'{self.branch_tip("main")}\n')
+
+        output, exit_code = self.run_lbranch(expected_exit_code=EXIT_SUCCESS)
+        self.assertIn('1) feature', output)
+        self.assertIn('2) main', output)
+        self.assertEqual(EXIT_SUCCESS, exit_code)
+
+    def test_refs_mode(self):
+        """Test listing branches by commit date with --mode refs"""
+        # Create branches with commits in a known date order, leaving main
+        # checked out
+        self.seed_repo([('feature', 'main'), ('other', 'main')])
 
-        # Test with -n flag
         output, exit_code = self.run_lbranch(
-            ['-n', '2'], expected_exit_code=EXIT_SUCCESS
+            ['--mode', 'refs'], expected_exit_code=EXIT_SUCCESS
         )
-        self.assertIn('Last 2 branches:', output)
-        self.assertIn('1) dev', output)
-        self.assertIn('2) b1', output)
-        self.assertNotIn('3) main', output)
+        self.assertIn('Last 5 branches:', output)
+        self.assertIn('1) other', output)
+        self.assertIn('2) feature', output)
+        self.assertNotIn('3)', output)
         self.assertEqual(EXIT_SUCCESS, exit_code)
 
-        # Test with --number flag
+    def test_refs_mode_tag_with_branch_name(self):
+        """Test that --mode refs lists plain branch names when tags share them"""
+        self.seed_repo([('v1', 'main'), ('feature', 'main')])
+        for name in ('v1', 'feature'):
+            with open(os.path.join(self.git_dir, 'refs', 'tags', name), 'w') as f:
+                f.write(f'{self.branch_tip(name)}\n')
+        self.record_checkouts(['v1'])
+
         output, exit_code = self.run_lbranch(
-            ['--number', '3'], expected_exit_code=EXIT_SUCCESS
+            ['--mode', 'refs'], expected_exit_code=EXIT_SUCCESS
         )
-        self.assertIn('Last 3 branches:', output)
-        self.assertIn('1) dev', output)
-        self.assertIn('2) b1', output)
-        self.assertIn('3) main', output)
+        self.assertIn('1) feature', output)
+        self.assertIn('2) main', output)
+        self.assertNotIn('heads/', output)
+        self.assertNotIn('v1', output)
         self.assertEqual(EXIT_SUCCESS, exit_code)
 
     def test_select_mode(self):
         """Test interactive select mode with invalid input"""
-        # Create initial commit on main
-        with open('README.md', 'w') as f:
-            f.write('initial')
-        subprocess.run(['git', 'add', 'README.md'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'commit', '-m', 'initial'], capture_output=True, check=True
-        )
-
-        # Create feature branch with commit
-        self.create_branch_with_commit('feature', 'feature content')
+        # Create feature branch with commit and check it out
+        self.seed_repo([('feature', 'main')])
+        self.record_checkouts(['feature'])
 
         # Test invalid selection (out of range)
         with mock.patch('builtins.input', return_value='999'):
@@ -259,16 +507,9 @@ class TestLBranch(unittest.TestCase):
 
     def test_keyboard_interrupt(self):
         """Test handling of keyboard interrupt (Ctrl+C)"""
-        # Create initial commit on main
-        with open('README.md', 'w') as f:
-            f.write('initial')
-        subprocess.run(['git', 'add', 'README.md'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'commit', '-m', 'initial'], capture_output=True, check=True
-        )
-
-        # Create feature branch with commit
-        self.create_branch_with_commit('feature', 'feature content')
+        # Create feature branch with commit and check it out
+        self.seed_repo([('feature', 'main')])
+        self.record_checkouts(['feature'])
 
         # Test KeyboardInterrupt
         with mock.patch('builtins.input', side_effect=KeyboardInterrupt):
@@ -282,18 +523,9 @@ class TestLBranch(unittest.TestCase):
 
     def test_color_flags(self):
         """Test --no-color and --force-color flags"""
-        # Create initial commit on main
-        with open('README.md', 'w') as f:
-            f.write('initial')
-        subprocess.run(['git', 'add', 'README.md'], capture_output=True, check=True)
-        subprocess.run(
-            ['git', 'commit', '-m', 'initial'], capture_output=True, check=True
-        )
-
         # Create and checkout new branch
-        subprocess.run(
-            ['git', 'checkout', '-b', 'feature'], capture_output=True, check=True
-        )
+        self.create_branch('feature')
+        self.record_checkouts(['feature'])
 
         # Test with --no-color flag
         output_no_color, exit_code = self.run_lbranch(
@@ -312,63 +544,109 @@ class TestLBranch(unittest.TestCase):
         self.assertEqual(EXIT_SUCCESS, exit_code)
 
 
+class TestExtractBranches(unittest.TestCase):
+    """Test reflog parsing independently of git"""
+
+    def test_reflog_formats(self):
+        """Test that subject-only and full reflog lines parse the same way"""
+        subjects = (
+            'checkout: moving from dev to main\n'
+            'commit: add feature\n'
+            'checkout: moving from main to dev\n'
+        )
+        full = (
+            'a1b2c3d HEAD@{0}: checkout: moving from dev to main\n'
+            'e4f5a6b HEAD@{1}: commit: add feature\n'
+            'e4f5a6b HEAD@{2}: checkout: moving from main to dev\n'
+        )
+        for output in (subjects, full):
+            branches = extract_branches_from_reflog(output.splitlines(), 'main')
+            self.assertEqual(['dev'], branches)
+
+
+class TestFormatBranchList(unittest.TestCase):
+    """Test the branch listing independently of git"""
+
+    def test_number_and_order(self):
+        """Test that the listing keeps order and stops at the requested number"""
+        output = format_branch_list(['dev', 'main', 'fix'], 2)
+        self.assertEqual('Last 2 branches:\n1) dev\n2) main\n', output)
+
+    def test_empty(self):
+        """Test that an empty history still prints the header"""
+        self.assertEqual('Last 5 branches:\n', format_branch_list([], 5))
+
+    def test_colors(self):
+        """Test that only the header is colored"""
+        output = format_branch_list(['dev'], 5, ANSI_COLORS)
+        self.assertEqual(
+            f'{ANSI_COLORS.blue}Last 5 branches:{ANSI_COLORS.nc}\n1) dev\n', output
+        )
+
+
+class TestReadCurrentBranch(unittest.TestCase):
+    """Test reading the current branch from HEAD without git"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory(dir=TEST_TMPDIR)
+        self.addCleanup(tmp.cleanup)
+        self.git_dir = tmp.name
+
+    def write_head(self, content):
+        with open(os.path.join(self.git_dir, 'HEAD'), 'w') as f:
+            f.write(content)
+
+    def test_branch(self):
+        """Test that a symbolic HEAD gives the branch name"""
+        self.write_head('ref: refs/heads/feature/x\n')
+        self.assertEqual('feature/x', read_current_branch(self.git_dir))
+
+    def test_detached_head(self):
+        """Test that a detached HEAD gives None"""
+        self.write_head(f'{"a" * 40}\n')
+        self.assertIsNone(read_current_branch(self.git_dir))
+
+    def test_reftable_placeholder(self):
+        """Test that the reftable placeholder HEAD gives None"""
+        self.write_head('ref: refs/heads/.invalid\n')
+        self.assertIsNone(read_current_branch(self.git_dir))
+
+    def test_missing_head(self):
+        """Test that a missing HEAD file gives None"""
+        self.assertIsNone(read_current_branch(self.git_dir))
+
+
 class TestColorSupport(unittest.TestCase):
     """Test color support detection functionality"""
 
-    @mock.patch('sys.stdout.isatty')
-    @mock.patch('platform.system')
-    @mock.patch.dict(os.environ, {}, clear=True)
-    def test_no_tty(self, mock_platform, mock_isatty):
+    def test_no_tty(self):
         """Test behavior when output is not to a TTY"""
-        mock_isatty.return_value = False
-        mock_platform.return_value = 'Linux'
-        self.assertFalse(supports_color())
-
-    @mock.patch('sys.stdout.isatty')
-    @mock.patch('platform.system')
-    @mock.patch.dict(os.environ, {'FORCE_COLOR': '1'}, clear=True)
-    def test_force_color(self, mock_platform, mock_isatty):
+        self.assertFalse(supports_color(isatty=False, system='Linux', env={}))
+
+    def test_force_color(self):
         """Test behavior with FORCE_COLOR env var"""
-        mock_isatty.return_value = False  # Should still return True due to FORCE_COLOR
-        mock_platform.return_value = 'Linux'
-        self.assertTrue(supports_color())
-
-    @mock.patch('sys.stdout.isatty')
-    @mock.patch('platform.system')
-    @mock.patch.dict(os.environ, {'NO_COLOR': '1'}, clear=True)
-    def test_no_color_env(self, mock_platform, mock_isatty):
+        # Should still return True without a TTY due to FORCE_COLOR
+        self.assertTrue(
+            supports_color(isatty=False, system='Linux', env={'FORCE_COLOR': '1'})
+        )
+
+    def test_no_color_env(self):
         """Test behavior with NO_COLOR env var"""
-        mock_isatty.return_value = True  # Would normally return True
-        mock_platform.return_value = 'Linux'
-        self.assertFalse(supports_color())
-
-    @mock.patch('sys.stdout.isatty')
-    @mock.patch('platform.system')
-    @mock.patch.dict(os.environ, {}, clear=True)
-    def test_windows_no_color_support(self, mock_platform, mock_isatty):
+        # A TTY would normally return True
+        self.assertFalse(
+            supports_color(isatty=True, system='Linux', env={'NO_COLOR': '1'})
+        )
+
+    def test_windows_no_color_support(self):
         """Test behavior on Windows with no color support"""
-        mock_isatty.return_value = True
-        mock_platform.return_value = 'Windows'
-        self.assertFalse(supports_color())
-
-    @mock.patch('sys.stdout.isatty')
-    @mock.patch('platform.system')
-    @mock.patch.dict(os.environ, {'WT_SESSION': '1'}, clear=True)
-    def test_windows_with_color_support(self, mock_platform, mock_isatty):
-        """Test behavior on Windows with color support (Windows Terminal)"""
-        mock_isatty.return_value = True
-        mock_platform.return_value = 'Windows'
-        self.assertTrue(supports_color())
-
-    @mock.patch('sys.stdout.isatty')
-    @mock.patch('platform.system')
-    @mock.patch.dict(os.environ, {}, clear=True)
-    def test_unix_default(self, mock_platform, mock_isatty):
-        """Test behavior on Unix with TTY"""
-        mock_isatty.return_value = True
-        mock_platform.return_value = 'Linux'
-        self.assertTrue(supports_color())
+        self.assertFalse(supports_color(isatty=True, system='Windows', env={}))
 
+    def test_windows_with_color_support(self):
+        """Test behavior on Windows with color support (Windows Terminal)"""
+        self.assertTrue(
+            supports_color(isatty=True, system='Windows', env={'WT_SESSION': '1'})
+        )
 
-if __name__ == '__main__':
-    unittest.main()
+    def test_unix_default(self):
+        """Test behavior on Unix with TTY"""
+        self.assertTrue(supports_color(isatty=True, system='Linux', env={}))